@@ -1,18 +1,27 @@
 import os
 import jwt
-import datetime as dt
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
 from typing import Optional
 
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
-from redis.asyncio import Redis
+from redis.asyncio import ConnectionPool, Redis
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 
 from database import User, get_session
 
+# 模块级预构建查询：避免每请求重新构造/编译 Select 结构
+_SEL_USER_BY_ID = select(User).where(User.id == bindparam("uid"))
+
 # 加载环境变量
 load_dotenv()
 
@@ -22,38 +31,101 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
 
+# Redis 连接池上限：按预期 WebSocket 并发量设置，建议与 DB_POOL_SIZE 同量级
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "100"))
+
+# bcrypt 代价因子（轮数），可通过环境变量调整
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
 # 密码哈希上下文（bcrypt）
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 
-def get_password_hash(password: str) -> str:
-    """生成密码哈希（bcrypt）"""
+async def get_password_hash(password: str) -> str:
+    """生成密码哈希（bcrypt，在线程池中执行避免阻塞事件循环）"""
 
-    return pwd_context.hash(password)
+    return await asyncio.to_thread(pwd_context.hash, password)
 
 
-def verify_password(plain_password: str, password_hash: str) -> bool:
-    """校验明文密码与哈希是否匹配"""
+async def verify_password(plain_password: str, password_hash: str) -> bool:
+    """校验明文密码与哈希是否匹配（在线程池中执行避免阻塞事件循环）"""
 
     try:
-        return pwd_context.verify(plain_password, password_hash)
+        return await asyncio.to_thread(pwd_context.verify, plain_password, password_hash)
     except Exception:
         return False
 
 
+# HS256 快速编码路径：JWT 头是常量，预计算其 base64 形式，省去每次签发的重复编码
+_JWT_HEADER_B64 = base64.urlsafe_b64encode(
+    orjson.dumps({"alg": JWT_ALGORITHM, "typ": "JWT"})
+).rstrip(b"=")
+_SECRET_BYTES = SECRET_KEY.encode("utf-8")
+
+
 def create_access_token(data: dict, expires_minutes: Optional[int] = None) -> str:
-    """生成 JWT Token"""
+    """生成 JWT Token（HS256 走手工 HMAC 快速路径，其它算法回退 PyJWT）"""
 
     to_encode = data.copy()
-    expire = dt.datetime.utcnow() + dt.timedelta(
-        minutes=expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES
-    )
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=JWT_ALGORITHM)
+    to_encode["exp"] = int(time.time()) + (expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES) * 60
+
+    if JWT_ALGORITHM != "HS256":
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+    payload_b64 = base64.urlsafe_b64encode(orjson.dumps(to_encode)).rstrip(b"=")
+    signing_input = _JWT_HEADER_B64 + b"." + payload_b64
+    signature = hmac.new(_SECRET_BYTES, signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + base64.urlsafe_b64encode(signature).rstrip(b"=")).decode("ascii")
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
+# 已验证 Token 负载缓存：短 TTL，避免同一 Token 反复执行完整 jwt.decode
+# （WebSocket 心跳与高频 HTTP 请求会用同一 Token 调用上千次）
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+def _cache_key(token: str) -> bytes:
+    """以 blake2b 摘要作为缓存键，避免长 Token 原文占用内存"""
+
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
+def _decode_cached(token: str) -> Optional[dict]:
+    """
+    解码 JWT（带缓存）
+    - 命中缓存时直接返回已验证的负载，但仍校验 exp 未过期
+    - 未命中时执行完整 jwt.decode，成功后写入缓存
+    - 无效 Token 不缓存，失败返回 None
+    """
+
+    key = _cache_key(token)
+    payload = _token_cache.get(key)
+    if payload is not None:
+        exp = payload.get("exp")
+        if exp is not None and float(exp) < time.time():
+            _token_cache.pop(key, None)
+            return None
+        return payload
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except Exception:
+        return None
+
+    _token_cache[key] = payload
+    return payload
+
+
+# 用户对象缓存：Token 生命周期内用户记录极少变化，短 TTL 可省去每请求一次 DB 查询
+_user_cache: TTLCache = TTLCache(maxsize=5000, ttl=60)
+
+
+def invalidate_user(user_id: int) -> None:
+    """用户信息变更（如改密）后调用，使缓存立即失效"""
+
+    _user_cache.pop(user_id, None)
+
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)
@@ -61,27 +133,48 @@ async def get_current_user(
     """
     获取当前用户（用于需要登录的 HTTP 接口）
     - 从 Authorization: Bearer 中解析 JWT
-    - 查询用户信息并返回 ORM 实例
+    - 查询用户信息并返回 ORM 实例（带 60s TTL 缓存，免去每请求 DB 往返）
     """
 
+    payload = _decode_cached(token)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        user_id = int(payload.get("sub"))
+        user_id = int(payload.get("sub")) if payload else None
     except Exception:
+        user_id = None
+    if user_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无效的令牌")
 
-    result = await session.execute(select(User).where(User.id == user_id))
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    result = await session.execute(_SEL_USER_BY_ID, {"uid": user_id})
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="用户不存在")
+
+    # 缓存脱离会话的实例，避免会话关闭后属性过期
+    session.expunge(user)
+    _user_cache[user_id] = user
     return user
 
 
+def token_payload(token: str) -> Optional[dict]:
+    """
+    获取 Token 的已验证负载，无效或过期返回 None
+    - 走 _decode_cached：心跳等高频复检场景几乎全部命中缓存，零解码开销
+    """
+
+    return _decode_cached(token)
+
+
 def decode_token_user_id(token: str) -> Optional[int]:
     """工具函数：从 Token 中解析用户 ID，失败返回 None"""
 
+    payload = _decode_cached(token)
+    if payload is None:
+        return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
         sub = payload.get("sub")
         return int(sub) if sub is not None else None
     except Exception:
@@ -93,9 +186,15 @@ _redis_client: Optional[Redis] = None
 
 
 async def get_redis() -> Redis:
-    """获取 Redis 异步客户端（单例）"""
+    """获取 Redis 异步客户端（单例，使用显式大小的连接池）"""
 
     global _redis_client
     if _redis_client is None:
-        _redis_client = Redis.from_url(REDIS_URL, decode_responses=True)
+        pool = ConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_POOL_SIZE,
+            decode_responses=True,
+            health_check_interval=30,
+        )
+        _redis_client = Redis(connection_pool=pool)
     return _redis_client
@@ -1,27 +1,38 @@
 import os
 import asyncio
-import json
 from typing import Optional
 import time
 
+import orjson
+import msgspec
+
+# 使用 uvloop 事件循环（libuv 实现，任务/锁调度开销低于默认 selector loop）
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # 加载 .env 环境变量
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy import select
+from sqlalchemy import bindparam, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import engine, Base, async_session, get_session, User
+from database import engine, Base, async_session, get_session, User, DB_POOL_SIZE
 from deps import (
     get_redis,
     create_access_token,
     verify_password,
     get_password_hash,
     decode_token_user_id,
+    token_payload,
+    get_current_user,
 )
 from websocket_manager import WebSocketRoomManager
 from models import UserCreate, UserLogin, Token
@@ -29,6 +40,19 @@ from models import UserCreate, UserLogin, Token
 
 app = FastAPI(title="Realtime Position Sync Demo")
 
+# 模块级预构建查询：避免每请求重新构造/编译 Select 结构
+_SEL_USER_BY_NAME = select(User).where(User.username == bindparam("uname"))
+
+
+async def _acquire_bcrypt_slot() -> bool:
+    """在限定时间内获取 bcrypt 信号量槽位，超时返回 False（调用方应答 503）"""
+
+    try:
+        await asyncio.wait_for(app.state.bcrypt_sem.acquire(), timeout=0.5)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
 # CORS 配置：允许来自环境变量指定的来源（默认 *）
 cors_origins_env = os.getenv("CORS_ORIGINS", "*")
 cors_origins = [o.strip() for o in cors_origins_env.split(",") if o.strip()] if cors_origins_env else ["*"]
@@ -57,6 +81,16 @@ async def on_startup():
     except Exception as e:
         print(f"[启动警告] 数据库表创建失败：{e}")
 
+    # 预热数据库连接池，避免首波请求时集中惰性建连
+    async def _warm_db_conn():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.gather(*[_warm_db_conn() for _ in range(min(DB_POOL_SIZE, 10))])
+    except Exception as e:
+        print(f"[启动警告] 数据库连接池预热失败：{e}")
+
     # 初始化 Redis 客户端与房间管理器
     redis = await get_redis()
     try:
@@ -64,38 +98,63 @@ async def on_startup():
     except Exception as e:
         print(f"[启动警告] Redis 连接失败：{e}")
 
+    # bcrypt 并发上限：线程池哈希仍会吃满 CPU，超出的请求快速失败返回 503 形成背压
+    app.state.bcrypt_sem = asyncio.Semaphore((os.cpu_count() or 1) * 2)
+
     app.state.ws_manager = WebSocketRoomManager(redis)
     app.state.kick_task = asyncio.create_task(app.state.ws_manager.kick_inactive_loop())
+    app.state.tick_task = asyncio.create_task(app.state.ws_manager.tick_loop())
+    app.state.gc_task = asyncio.create_task(app.state.ws_manager.redis_gc_loop())
+    app.state.bus_task = asyncio.create_task(app.state.ws_manager.subscriber_loop())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
     """关闭事件：取消后台任务"""
 
-    try:
-        task = getattr(app.state, "kick_task", None)
-        if task:
-            task.cancel()
-    except Exception:
-        pass
+    for name in ("kick_task", "tick_task", "gc_task", "bus_task"):
+        try:
+            task = getattr(app.state, name, None)
+            if task:
+                task.cancel()
+        except Exception:
+            pass
 
 
 @app.post("/api/register")
-async def register(user: UserCreate, session: AsyncSession = Depends(get_session)):
+async def register(request: Request, session: AsyncSession = Depends(get_session)):
     """
     用户注册
+    - 请求体用 msgspec 解码校验（跳过 Pydantic 每请求验证开销）
     - 校验用户名唯一
     - 存储密码哈希
     """
 
+    try:
+        user = msgspec.json.decode(await request.body(), type=UserCreate)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"detail": f"请求体格式错误: {e}"}
+        )
+
     try:
         # 查重用户名
-        existing = await session.execute(select(User).where(User.username == user.username))
+        existing = await session.execute(_SEL_USER_BY_NAME, {"uname": user.username})
         if existing.scalar_one_or_none():
             return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "用户名已存在"})
 
+        # 哈希计算受信号量保护：CPU 饱和时快速返回 503 而非无界排队
+        if not await _acquire_bcrypt_slot():
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "服务器繁忙，请稍后重试"}
+            )
+        try:
+            password_hash = await get_password_hash(user.password)
+        finally:
+            app.state.bcrypt_sem.release()
+
         # 保存用户
-        new_user = User(username=user.username, password_hash=get_password_hash(user.password))
+        new_user = User(username=user.username, password_hash=password_hash)
         session.add(new_user)
         await session.commit()
         return {"message": "注册成功"}
@@ -103,31 +162,83 @@ async def register(user: UserCreate, session: AsyncSession = Depends(get_session
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"detail": f"注册失败: {str(e)}"})
 
 
-@app.post("/api/login", response_model=Token)
-async def login(payload: UserLogin, session: AsyncSession = Depends(get_session)):
+@app.post("/api/login")
+async def login(request: Request, session: AsyncSession = Depends(get_session)):
     """
     用户登录
+    - 请求体用 msgspec 解码校验，响应用 msgspec 编码
     - 校验用户名与密码
     - 返回 JWT Token
     """
 
     try:
-        result = await session.execute(select(User).where(User.username == payload.username))
+        payload = msgspec.json.decode(await request.body(), type=UserLogin)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"detail": f"请求体格式错误: {e}"}
+        )
+
+    try:
+        result = await session.execute(_SEL_USER_BY_NAME, {"uname": payload.username})
         user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="用户名或密码错误")
 
-        if not verify_password(payload.password, user.password_hash):
+        # 校验受信号量保护：CPU 饱和时快速返回 503 而非无界排队
+        if not await _acquire_bcrypt_slot():
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="服务器繁忙，请稍后重试")
+        try:
+            password_ok = await verify_password(payload.password, user.password_hash)
+        finally:
+            app.state.bcrypt_sem.release()
+
+        if not password_ok:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="用户名或密码错误")
 
         token = create_access_token({"sub": str(user.id)})
-        return Token(access_token=token)
+        return Response(
+            content=msgspec.json.encode(Token(access_token=token)), media_type="application/json"
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"登录失败: {e}")
 
 
+@app.get("/api/rooms")
+async def list_rooms(user: User = Depends(get_current_user)):
+    """
+    房间列表（需登录）
+    - 返回所有房间 ID 与在线人数，人数统计批量走一次 Redis pipeline
+    """
+
+    try:
+        rooms = await app.state.ws_manager.get_rooms()
+        return {"rooms": rooms}
+    except Exception as e:
+        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"detail": f"查询失败: {e}"})
+
+
+async def _send_json(websocket: WebSocket, message: dict) -> None:
+    """用 orjson 编码后以二进制帧发送（比 send_json 的标准库编码快数倍）"""
+
+    await websocket.send_bytes(orjson.dumps(message))
+
+
+async def _receive_json(websocket: WebSocket) -> dict:
+    """接收一帧并用 orjson 解析，兼容文本帧与二进制帧"""
+
+    message = await websocket.receive()
+    if message.get("type") == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code") or 1000)
+    raw = message.get("bytes")
+    if raw is None:
+        raw = message.get("text")
+    if raw is None:
+        raise ValueError("空消息帧")
+    return orjson.loads(raw)
+
+
 def _extract_token(websocket: WebSocket) -> Optional[str]:
     """从 WebSocket Header 或 Query 中提取 Bearer Token"""
     # Header 优先
@@ -146,6 +257,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     """
     WebSocket 连接：
     - 连接时必须携带 JWT（Header Bearer 或 ?token）
+    - 可用 ?proto=bin 协商二进制 state 帧（增量、float32 坐标）
     - 加入房间并广播 join/state
     - 处理 move/ping 消息；广播 state 或回复 pong
     - 断开或超时自动 leave 并广播
@@ -160,7 +272,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     token = _extract_token(websocket)
     if not token:
         try:
-            await websocket.send_json({"type": "auth", "message": "false"})
+            await _send_json(websocket, {"type": "auth", "message": "false"})
             await asyncio.sleep(0.2)
         except Exception:
             pass
@@ -171,7 +283,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     user_id = decode_token_user_id(token)
     if user_id is None:
         try:
-            await websocket.send_json({"type": "auth", "message": "false"})
+            await _send_json(websocket, {"type": "auth", "message": "false"})
             await asyncio.sleep(0.2)
         except Exception:
             pass
@@ -182,9 +294,10 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     manager: WebSocketRoomManager = app.state.ws_manager
     player_id = str(user_id)
 
-    # 加入房间并广播
+    # 加入房间并广播（按查询参数协商二进制 state 协议）
+    binary_mode = websocket.query_params.get("proto") == "bin"
     try:
-        await manager.join(room_id, player_id, websocket)
+        await manager.join(room_id, player_id, websocket, binary=binary_mode)
     except Exception:
         # 无法加入则关闭
         await websocket.close()
@@ -193,7 +306,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     try:
         while True:
             try:
-                data = await websocket.receive_json()
+                data = await _receive_json(websocket)
             except WebSocketDisconnect:
                 break
             except Exception:
@@ -209,23 +322,23 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
                     continue
                 await manager.update_position(room_id, player_id, x, y)
             elif msg_type == "ping":
-                # 在心跳时验证 Token 是否仍有效，若失效则通知前端并断开
-                if decode_token_user_id(token) is None:
+                # 在心跳时验证 Token 是否仍有效（缓存负载 + exp 校验，不重复解码），失效则通知前端并断开
+                if token_payload(token) is None:
                     try:
-                        await websocket.send_json({"type": "auth", "message": "false"})
+                        await _send_json(websocket, {"type": "auth", "message": "false"})
                         await asyncio.sleep(0.2)
                     except Exception:
                         pass
                     await websocket.close(code=1008)
                     break
                 try:
-                    await websocket.send_json({"type": "pong"})
+                    await _send_json(websocket, {"type": "pong"})
                 except Exception:
                     pass
                 await manager.touch(room_id, player_id)
             else:
                 try:
-                    await websocket.send_json({"type": "error", "message": "未知消息类型"})
+                    await _send_json(websocket, {"type": "error", "message": "未知消息类型"})
                 except Exception:
                     pass
     except WebSocketDisconnect:
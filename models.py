@@ -1,23 +1,25 @@
-from typing import List, Optional
-from pydantic import BaseModel, Field, ConfigDict
+from typing import Annotated, List, Optional
 
+import msgspec
+from pydantic import BaseModel, ConfigDict
 
-class UserCreate(BaseModel):
-    """用户注册请求模型"""
 
-    username: str = Field(min_length=3, max_length=64, description="用户名")
-    password: str = Field(min_length=6, max_length=128, description="密码")
+class UserCreate(msgspec.Struct):
+    """用户注册请求模型（msgspec，C 实现的解码与约束校验）"""
 
+    username: Annotated[str, msgspec.Meta(min_length=3, max_length=64, description="用户名")]
+    password: Annotated[str, msgspec.Meta(min_length=6, max_length=128, description="密码")]
 
-class UserLogin(BaseModel):
-    """用户登录请求模型"""
+
+class UserLogin(msgspec.Struct):
+    """用户登录请求模型（msgspec）"""
 
     username: str
     password: str
 
 
-class Token(BaseModel):
-    """登录成功返回的 JWT"""
+class Token(msgspec.Struct):
+    """登录成功返回的 JWT（msgspec 编码）"""
 
     access_token: str
     token_type: str = "bearer"
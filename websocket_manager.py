@@ -1,24 +1,72 @@
 import asyncio
+import heapq
+import struct
 import time
+import uuid
 import random
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional, Tuple
 
+import orjson
 from fastapi import WebSocket
 from redis.asyncio import Redis
 
+# 二进制 state 帧格式（客户端以 ?proto=bin 协商后使用）：
+# b'S' + uint16 玩家数量 + 数量 * (uint32 玩家ID + float32 x + float32 y)
+_STATE_HEADER = struct.Struct("<cH")
+_STATE_ENTRY = struct.Struct("<Iff")
+
+# 服务端 GC 脚本：单次调用内在 Redis 侧遍历成员、判定陈旧并删除，
+# 避免 smembers + N 次 hget/srem/del 的逐成员往返
+# KEYS[1] = room:{id}:members, KEYS[2] = room:{id}:player: 前缀, ARGV[1] = 截止时间戳
+_GC_SCRIPT = """
+local members = redis.call('SMEMBERS', KEYS[1])
+for i, pid in ipairs(members) do
+  local ls = redis.call('HGET', KEYS[2]..pid, 'last_seen')
+  if not ls or tonumber(ls) < tonumber(ARGV[1]) then
+    redis.call('SREM', KEYS[1], pid)
+    redis.call('DEL', KEYS[2]..pid)
+  end
+end
+"""
+
 
 class RoomState:
     """
     房间内状态（内存结构）
     - connections: player_id -> WebSocket
-    - players: player_id -> {x, y, color, last_seen}
+    - queues/writers: player_id -> 出站队列与常驻写出任务
+      （广播只入队，发送由每连接一个的写出协程完成）
+    - players: player_id -> {player_id, x, y, color}
+      该字典即广播负载本体，原地更新，tick 广播零字典分配
+    - last_seen: player_id -> 时间戳（热字段单独存放，不混入广播负载）
     - lock: 房间级别的异步锁，保证并发安全
+    - players_snapshot/conn_snapshot: 成员变动时重建的不可变快照，
+      供广播路径无锁读取（写时复制，读方无需持锁）
     """
 
     def __init__(self) -> None:
         self.lock = asyncio.Lock()
         self.connections: Dict[str, WebSocket] = {}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.writers: Dict[str, asyncio.Task] = {}
         self.players: Dict[str, Dict[str, Any]] = {}
+        self.last_seen: Dict[str, float] = {}
+        # 每玩家复用的 Redis HSET mapping（原地更新，避免每次落盘都构造新字典）
+        self.redis_maps: Dict[str, Dict[str, Any]] = {}
+        # 每玩家上次把 last_seen 写入 Redis 的时间（心跳落盘节流用）
+        self.redis_last_write: Dict[str, float] = {}
+        # 本 tick 内坐标有变化、待批量写入 Redis 的玩家
+        self.dirty_players: set = set()
+        # 协商了二进制 state 协议（?proto=bin）的玩家
+        self.binary_players: set = set()
+        self.players_snapshot: tuple = ()
+        self.conn_snapshot: tuple = ()
+
+    def rebuild_snapshots(self) -> None:
+        """在持锁状态下于成员变动后调用，原子替换只读快照"""
+
+        self.players_snapshot = tuple(self.players.items())
+        self.conn_snapshot = tuple(self.queues.items())
 
 
 class WebSocketRoomManager:
@@ -28,45 +76,99 @@ class WebSocketRoomManager:
     - Redis 用于持久化与跨进程共享玩家状态
     """
 
-    def __init__(self, redis: Redis, kick_timeout_seconds: int = 60, scan_interval_seconds: int = 10) -> None:
+    def __init__(
+        self,
+        redis: Redis,
+        kick_timeout_seconds: int = 60,
+        scan_interval_seconds: int = 10,
+        tick_hz: int = 20,
+    ) -> None:
         self.redis = redis
         self.rooms: Dict[str, RoomState] = {}
         self.kick_timeout_seconds = kick_timeout_seconds
         self.scan_interval_seconds = scan_interval_seconds
+        # 心跳 last_seen 落盘节流间隔：持久化时间戳只需对 GC 判定够新即可
+        self._touch_persist_interval = min(scan_interval_seconds / 4, 5.0)
+        # 状态广播频率：move 消息只标记脏房间，由 tick_loop 统一按此频率广播
+        self.tick_hz = tick_hz
+        self._dirty_rooms: set = set()
+        # 到期最小堆：(last_seen + 超时, room_id, player_id)
+        # 心跳/移动只追加新条目，旧条目在弹出时按当前 last_seen 判定后丢弃
+        self._expiry_heap: list = []
+        # 服务端 GC 脚本的 SHA（懒加载，Redis 重启清空脚本缓存后会重载）
+        self._gc_sha: Optional[str] = None
+        # 本 worker 标识：广播经 Redis 总线转发到其它进程时用于抑制自身回声
+        self._worker_id = uuid.uuid4().hex
+
+    def _schedule_expiry(self, room_id: str, player_id: str, last_seen: float) -> None:
+        """将玩家的下一个踢出期限压入最小堆"""
+
+        heapq.heappush(self._expiry_heap, (last_seen + self.kick_timeout_seconds, room_id, player_id))
 
     def _ensure_room(self, room_id: str) -> RoomState:
-        if room_id not in self.rooms:
-            self.rooms[room_id] = RoomState()
-        return self.rooms[room_id]
+        # get 命中即返回，未命中才走 setdefault：常见路径只做一次字典查找
+        room = self.rooms.get(room_id)
+        return room if room is not None else self.rooms.setdefault(room_id, RoomState())
 
-    async def join(self, room_id: str, player_id: str, websocket: WebSocket) -> str:
+    async def join(self, room_id: str, player_id: str, websocket: WebSocket, binary: bool = False) -> str:
         """
         加入房间：分配颜色、初始化坐标、写入 Redis、广播 join 与当前 state
+        binary=True 表示客户端协商了二进制 state 协议（?proto=bin）
         返回分配的颜色字符串
         """
 
         room = self._ensure_room(room_id)
+        now = time.time()
         async with room.lock:
+            # 同名玩家重连（刷新页面等，旧连接清理未完成）：先回收旧写出任务与队列，
+            # 否则旧任务会永远阻塞在无人再写的队列上，连带泄漏旧 WebSocket
+            old_writer = room.writers.pop(player_id, None)
+            if old_writer is not None:
+                old_writer.cancel()
+            room.queues.pop(player_id, None)
+            old_ws: Optional[WebSocket] = room.connections.pop(player_id, None)
+
             # 分配随机颜色，初始化坐标
             color = f"#{random.randint(0, 0xFFFFFF):06x}"
             room.connections[player_id] = websocket
+            # 每连接一个有界出站队列 + 常驻写出任务，广播方只入队不 await 发送
+            queue: asyncio.Queue = asyncio.Queue(maxsize=32)
+            room.queues[player_id] = queue
+            room.writers[player_id] = asyncio.create_task(self._writer_loop(websocket, queue))
+            if binary:
+                room.binary_players.add(player_id)
             room.players[player_id] = {
+                "player_id": player_id,
                 "x": 0.0,
                 "y": 0.0,
                 "color": color,
-                "last_seen": time.time(),
             }
-
-            # 写入 Redis
+            room.last_seen[player_id] = now
+            room.redis_maps[player_id] = {"x": 0.0, "y": 0.0, "last_seen": now}
+            room.redis_last_write[player_id] = now
+            room.rebuild_snapshots()
+            self._schedule_expiry(room_id, player_id, now)
+
+        # 关闭被替换的旧连接（锁外，避免持锁等网络）
+        if old_ws is not None and old_ws is not websocket:
             try:
-                await self.redis.sadd(f"room:{room_id}:members", player_id)
-                await self.redis.hset(
-                    f"room:{room_id}:player:{player_id}", mapping={"x": 0.0, "y": 0.0, "color": color}
-                )
+                await old_ws.close()
             except Exception:
-                # Redis 异常不阻断加入流程
                 pass
 
+        # 写入 Redis（pipeline 合并为一次往返）；移到锁外，持锁跨网络往返会放大锁等待
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sadd(f"room:{room_id}:members", player_id)
+            pipe.hset(
+                f"room:{room_id}:player:{player_id}",
+                mapping={"x": 0.0, "y": 0.0, "color": color, "last_seen": now},
+            )
+            await pipe.execute()
+        except Exception:
+            # Redis 异常不阻断加入流程
+            pass
+
         # 锁外广播，避免死锁
         await self._broadcast(room_id, {"type": "join", "player_id": player_id})
         await self.broadcast_state(room_id)
@@ -78,121 +180,387 @@ class WebSocketRoomManager:
 
         room = self._ensure_room(room_id)
         async with room.lock:
-            # 关闭连接（若仍存在）
+            # 停止写出任务，摘除连接与玩家状态
+            writer = room.writers.pop(player_id, None)
+            if writer is not None:
+                writer.cancel()
+            room.queues.pop(player_id, None)
             ws: Optional[WebSocket] = room.connections.pop(player_id, None)
-            if ws is not None:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
 
             room.players.pop(player_id, None)
-
-            # 清理 Redis
+            room.last_seen.pop(player_id, None)
+            room.redis_maps.pop(player_id, None)
+            room.redis_last_write.pop(player_id, None)
+            room.binary_players.discard(player_id)
+            room.rebuild_snapshots()
+
+        # 关闭连接与清理 Redis 移到锁外：二者都可能跨网络等待，不应占用房间锁
+        if ws is not None:
             try:
-                await self.redis.srem(f"room:{room_id}:members", player_id)
-                await self.redis.delete(f"room:{room_id}:player:{player_id}")
+                await ws.close()
             except Exception:
                 pass
 
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.srem(f"room:{room_id}:members", player_id)
+            pipe.delete(f"room:{room_id}:player:{player_id}")
+            await pipe.execute()
+        except Exception:
+            pass
+
         # 锁外广播，避免死锁
         await self._broadcast(room_id, {"type": "leave", "player_id": player_id})
         await self.broadcast_state(room_id)
 
+        # 房间已空则整体回收，避免 rooms 字典随历史 room_id 无界增长
+        async with room.lock:
+            if not room.connections and not room.players:
+                self.rooms.pop(room_id, None)
+                self._dirty_rooms.discard(room_id)
+
+    async def get_player_count(self, room_id: str) -> int:
+        """
+        查询房间人数（跨进程视角，以 Redis 成员集合为准）
+        - 单次 SCARD 往返，切勿用 smembers + 逐个 hget 的 O(N) RTT 写法
+        - Redis 不可用时回退本进程内存中的人数
+        """
+
+        try:
+            return int(await self.redis.scard(f"room:{room_id}:members"))
+        except Exception:
+            room = self.rooms.get(room_id)
+            return len(room.players) if room is not None else 0
+
+    async def get_rooms(self) -> list:
+        """
+        列出所有房间及在线人数（跨进程视角，以 Redis 为准）
+        - SCAN 收集房间键后用单个 pipeline 批量 SCARD，
+          往返次数不随房间数/玩家数线性增长（SCAN 批次除外）
+        - Redis 不可用时回退本进程内存
+        """
+
+        try:
+            keys = [key async for key in self.redis.scan_iter(match="room:*:members")]
+            if not keys:
+                return []
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.scard(key)
+            counts = await pipe.execute()
+            return [
+                {"room_id": key[len("room:"):-len(":members")], "player_count": int(count)}
+                for key, count in zip(keys, counts)
+            ]
+        except Exception:
+            return [
+                {"room_id": rid, "player_count": len(room.players)}
+                for rid, room in self.rooms.items()
+            ]
+
     async def touch(self, room_id: str, player_id: str) -> None:
-        """刷新玩家心跳时间戳"""
+        """
+        刷新玩家心跳时间戳
+        - 纯内存写，无 await 点，整段在事件循环内原子执行，无需取房间锁
+        """
 
         room = self._ensure_room(room_id)
-        async with room.lock:
-            if player_id in room.players:
-                room.players[player_id]["last_seen"] = time.time()
+        if player_id in room.players:
+            now = time.time()
+            room.last_seen[player_id] = now
+            self._schedule_expiry(room_id, player_id, now)
+
+            # 节流落盘：持久化的 last_seen 只需对 GC 的粒度够新，
+            # 每个心跳都写 Redis 纯属浪费 IO
+            if now - room.redis_last_write.get(player_id, 0.0) < self._touch_persist_interval:
+                return
+            room.redis_last_write[player_id] = now
+            try:
+                await self.redis.hset(f"room:{room_id}:player:{player_id}", "last_seen", now)
+            except Exception:
+                pass
 
     async def update_position(self, room_id: str, player_id: str, x: float, y: float) -> None:
         """
-        更新玩家坐标（内存与 Redis），并广播房间最新 state
+        更新玩家坐标（内存与 Redis），并标记房间待广播
+        - 不在此处广播：由 tick_loop 以固定频率统一推送，避免 O(K²·M) 扇出
+        - 纯内存写，无 await 点，整段在事件循环内原子执行，无需取房间锁
         """
 
         room = self._ensure_room(room_id)
-        async with room.lock:
-            if player_id not in room.players:
-                return
-            room.players[player_id]["x"] = float(x)
-            room.players[player_id]["y"] = float(y)
-            room.players[player_id]["last_seen"] = time.time()
+        player = room.players.get(player_id)
+        if player is None:
+            return
+        x, y = float(x), float(y)
+        now = time.time()
+        room.last_seen[player_id] = now
+        self._schedule_expiry(room_id, player_id, now)
+
+        # 坐标未变化（客户端原地重发）则只刷新心跳，不触发广播与 Redis 写入
+        if player["x"] == x and player["y"] == y:
+            return
+
+        player["x"] = x
+        player["y"] = y
+        # Redis 写入也延迟到 tick：记录本 tick 变化的玩家，由 _flush_positions 批量落盘
+        room.dirty_players.add(player_id)
 
+        # 只标记脏房间，广播延迟到下一个 tick
+        self._dirty_rooms.add(room_id)
+
+    async def tick_loop(self) -> None:
+        """
+        后台任务：按固定频率（tick_hz）广播有状态变化的房间
+        - 同一 tick 内的多次 move 只触发一次广播，带宽随 tick 频率封顶
+        """
+
+        interval = 1.0 / self.tick_hz
+        while True:
             try:
-                await self.redis.hset(
-                    f"room:{room_id}:player:{player_id}", mapping={"x": float(x), "y": float(y)}
-                )
+                await asyncio.sleep(interval)
+                if not self._dirty_rooms:
+                    continue
+                dirty, self._dirty_rooms = self._dirty_rooms, set()
+                for room_id in dirty:
+                    moved = await self._flush_positions(room_id)
+                    await self.broadcast_state(room_id, moved=moved)
+            except asyncio.CancelledError:
+                break
             except Exception:
-                pass
-
-        # 广播最新状态（锁外广播以减少阻塞）
-        await self.broadcast_state(room_id)
+                # 避免任务因异常退出
+                await asyncio.sleep(interval)
 
-    async def broadcast_state(self, room_id: str) -> None:
-        """广播当前房间内所有玩家的最新状态"""
+    async def _flush_positions(self, room_id: str) -> set:
+        """
+        将本 tick 内有变化的玩家坐标合并为单个 pipeline 写入 Redis（N 次 HSET 一次往返）
+        返回本 tick 有移动的玩家 ID 集合，供增量广播使用
+        """
 
         room = self._ensure_room(room_id)
-        # 构建状态快照（避免长时间持锁）
         async with room.lock:
-            players_payload = [
-                {
-                    "player_id": pid,
-                    "x": info.get("x", 0.0),
-                    "y": info.get("y", 0.0),
-                    "color": info.get("color", "#ffffff"),
-                }
-                for pid, info in room.players.items()
-            ]
+            dirty, room.dirty_players = room.dirty_players, set()
+            entries = []
+            for pid in dirty:
+                player = room.players.get(pid)
+                mapping = room.redis_maps.get(pid)
+                if player is None or mapping is None:
+                    continue
+                # 复用每玩家的 mapping 字典，原地刷新字段
+                mapping["x"] = player["x"]
+                mapping["y"] = player["y"]
+                mapping["last_seen"] = room.last_seen.get(pid, 0.0)
+                entries.append((pid, mapping))
+
+        if not entries:
+            return dirty
 
-        await self._broadcast(room_id, {"type": "state", "players": players_payload})
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for pid, mapping in entries:
+                pipe.hset(f"room:{room_id}:player:{pid}", mapping=mapping)
+            await pipe.execute()
+        except Exception:
+            pass
+        return dirty
 
-    async def _broadcast(self, room_id: str, message: Dict[str, Any]) -> None:
-        """向房间内所有连接广播消息，忽略单个发送错误"""
+    @staticmethod
+    def _pack_state_frame(entries: Iterable[Tuple[str, Dict[str, Any]]]) -> bytes:
+        """
+        打包二进制 state 帧：SoA 紧凑布局，float32 坐标
+        玩家 ID 非数字时跳过该条目（协议以 uint32 传输 ID）
+        """
+
+        body = []
+        for pid, info in entries:
+            try:
+                body.append(_STATE_ENTRY.pack(int(pid), info.get("x", 0.0), info.get("y", 0.0)))
+            except Exception:
+                continue
+        return _STATE_HEADER.pack(b"S", len(body)) + b"".join(body)
+
+    async def broadcast_state(self, room_id: str, moved: Optional[set] = None) -> None:
+        """
+        广播当前房间内所有玩家的最新状态
+        - JSON 客户端始终收到全量 state
+        - 二进制客户端收到紧凑增量帧（moved 为 None 时发送全量，如 join/leave 之后）
+        """
 
         room = self._ensure_room(room_id)
-        # 复制连接列表，避免发送过程中集合被修改
-        async with room.lock:
-            conns = list(room.connections.items())
+        # 读取不可变快照构建负载，无需与写方争锁
+        # players 字典本身即广播负载（原地更新），每 tick 不再分配 N 个新字典
+        snapshot = room.players_snapshot
+        players_payload = [info for _, info in snapshot]
 
-        if not conns:
-            return
+        bin_payload: Optional[bytes] = None
+        if room.binary_players:
+            entries = snapshot if moved is None else [(pid, info) for pid, info in snapshot if pid in moved]
+            bin_payload = self._pack_state_frame(entries)
 
-        send_tasks = []
-        for pid, ws in conns:
-            send_tasks.append(self._safe_send(ws, message))
-        await asyncio.gather(*send_tasks, return_exceptions=True)
+        await self._broadcast(room_id, {"type": "state", "players": players_payload}, bin_payload=bin_payload)
 
     @staticmethod
-    async def _safe_send(ws: WebSocket, message: Dict[str, Any]) -> None:
+    def _enqueue_frames(room: RoomState, payload: bytes, bin_payload: Optional[bytes]) -> None:
+        """
+        将帧写入本进程各连接的出站队列
+        - 只入队不发送：零 Task 分配，实际写出由每连接的常驻写出任务完成
+        - 提供 bin_payload 时，协商了二进制协议的客户端收到该帧，其余收到 JSON
+        """
+
+        binary_players = room.binary_players
+        for pid, queue in room.conn_snapshot:
+            frame = bin_payload if (bin_payload is not None and pid in binary_players) else payload
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # 慢消费者：丢最旧帧腾位，保证客户端最终收到的是最新状态
+                try:
+                    queue.get_nowait()
+                    queue.put_nowait(frame)
+                except (asyncio.QueueEmpty, asyncio.QueueFull):
+                    pass
+
+    async def _broadcast(self, room_id: str, message: Dict[str, Any], bin_payload: Optional[bytes] = None) -> None:
+        """向房间内所有连接广播消息（本地入队 + 发布到跨进程总线），忽略单个发送错误"""
+
+        room = self._ensure_room(room_id)
+        # 只序列化一次，同一份字节帧发给所有连接（避免每连接重复 JSON 编码）
+        payload = orjson.dumps(message)
+        # 连接快照为不可变元组，发送期间集合变动只会产生新快照
+        if room.conn_snapshot:
+            self._enqueue_frames(room, payload, bin_payload)
+
+        # 发布到房间总线，供其它 worker 转发给各自的本地连接；带 worker 标记抑制回声
+        # state 帧只含本 worker 的玩家，总线副本标记 partial，客户端据此合并而非整体替换
         try:
-            await ws.send_json(message)
+            if message.get("type") == "state":
+                bus_payload = orjson.dumps({**message, "partial": True}).decode("utf-8")
+            else:
+                bus_payload = payload.decode("utf-8")
+            await self.redis.publish(f"room:{room_id}:bus", self._worker_id + "|" + bus_payload)
         except Exception:
-            # 忽略单个连接的发送错误
             pass
 
+    async def subscriber_loop(self) -> None:
+        """
+        后台任务：订阅房间总线，把其它 worker 的广播转发给本进程的连接
+        - 多 worker 水平扩展时，各进程只直接持有自己 accept 的 WebSocket
+        - 转发帧为 JSON（二进制协商只对本地广播生效）
+        - 来自其它 worker 的 state 帧带 partial=true：它只覆盖该 worker
+          的玩家子集，客户端应按 player_id 合并，不能整体替换世界状态
+        """
+
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.psubscribe("room:*:bus")
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    data = message.get("data") or ""
+                    worker_id, _, payload = data.partition("|")
+                    if not payload or worker_id == self._worker_id:
+                        continue
+                    channel = message.get("channel") or ""
+                    room_id = channel[len("room:"):-len(":bus")]
+                    room = self.rooms.get(room_id)
+                    if room is not None:
+                        self._enqueue_frames(room, payload.encode("utf-8"), None)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                # 连接中断等：稍后重建订阅
+                await asyncio.sleep(1.0)
+            finally:
+                # 重试前必须归还订阅连接，否则每次抖动都会泄漏一个池内连接
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    @staticmethod
+    async def _writer_loop(ws: WebSocket, queue: asyncio.Queue) -> None:
+        """单连接常驻写出任务：从出站队列取帧并发送，连接异常即退出"""
+
+        try:
+            while True:
+                payload = await queue.get()
+                await ws.send_bytes(payload)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 发送失败（连接已断开等），由断开清理逻辑负责收尾
+            pass
+
+    async def _run_gc_script(self, members_key: str, player_prefix: str, cutoff: float) -> None:
+        """执行服务端 GC 脚本；脚本缓存失效（如 Redis 重启）时重载后重试一次"""
+
+        if self._gc_sha is None:
+            self._gc_sha = await self.redis.script_load(_GC_SCRIPT)
+        try:
+            await self.redis.evalsha(self._gc_sha, 2, members_key, player_prefix, cutoff)
+        except Exception:
+            self._gc_sha = await self.redis.script_load(_GC_SCRIPT)
+            await self.redis.evalsha(self._gc_sha, 2, members_key, player_prefix, cutoff)
+
+    async def redis_gc_loop(self) -> None:
+        """
+        后台任务：回收 Redis 中的陈旧玩家数据（跨进程兜底）
+        - 进程异常退出时会留下未经 leave 清理的孤儿键，本进程踢人逻辑覆盖不到
+        - 每个房间的判定与删除在 Redis 服务端由单个 Lua 脚本完成，
+          不产生逐成员的网络往返
+        - 截止线取 2 倍踢人超时，确保只回收确实无人维护的数据
+        """
+
+        interval = max(self.kick_timeout_seconds, self.scan_interval_seconds)
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                cutoff = time.time() - 2 * self.kick_timeout_seconds
+                async for key in self.redis.scan_iter(match="room:*:members"):
+                    player_prefix = key[: -len("members")] + "player:"
+                    await self._run_gc_script(key, player_prefix, cutoff)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                # 避免任务因异常退出
+                await asyncio.sleep(interval)
+
     async def kick_inactive_loop(self) -> None:
         """
-        后台任务：周期性检查超时未心跳的玩家并踢出
+        后台任务：基于到期最小堆踢出超时玩家
         - 超过 self.kick_timeout_seconds 无任何消息则关闭连接并移除
+        - 只在最早期限到达时唤醒，每次唤醒只处理真正到期的玩家，
+          无需周期性全量遍历所有房间与玩家
         """
 
         while True:
             try:
+                if not self._expiry_heap:
+                    await asyncio.sleep(self.scan_interval_seconds)
+                    continue
+
+                deadline = self._expiry_heap[0][0]
                 now = time.time()
-                # 遍历所有房间与玩家
-                for room_id, room in list(self.rooms.items()):
-                    async with room.lock:
-                        inactive = [
-                            pid
-                            for pid, info in room.players.items()
-                            if now - float(info.get("last_seen", 0)) > self.kick_timeout_seconds
-                        ]
-                    for pid in inactive:
-                        # 调用 leave 进行清理与广播
-                        await self.leave(room_id, pid)
-                await asyncio.sleep(self.scan_interval_seconds)
+                if deadline > now:
+                    # 睡到最早期限；期间如有新连接，其期限必然更晚，无需提前唤醒
+                    await asyncio.sleep(min(deadline - now, self.scan_interval_seconds))
+                    continue
+
+                # 截止线只算一次：last_seen < cutoff 即超时，免去每条目的减法与属性访问
+                cutoff = now - self.kick_timeout_seconds
+
+                _, room_id, player_id = heapq.heappop(self._expiry_heap)
+                room = self.rooms.get(room_id)
+                if room is None:
+                    continue
+                last_seen = room.last_seen.get(player_id)
+                if last_seen is None:
+                    continue
+                # 弹出后按当前 last_seen 复核；心跳刷新过的是过期堆条目，直接丢弃
+                if last_seen < cutoff:
+                    await self.leave(room_id, player_id)
             except asyncio.CancelledError:
                 break
             except Exception: